@@ -7,6 +7,8 @@ and formats them for API posting. Includes built-in API posting logic.
 """
 
 import argparse
+import base64
+import functools
 import json
 import os
 import socket
@@ -14,11 +16,28 @@ import subprocess
 import sys
 import re
 import hashlib
+import http.client
+import urllib.parse
 import urllib.request
-import urllib.error
 import ssl
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import Dict, List, Tuple
 
+# Precompiled patterns for parsing cpstat / cphaprob output
+# Row of the 'cpstat os -f multi_cpu' table: |CPU#|User|System|Idle|Usage|...
+_RE_CPU_ROW = re.compile(r'^\s*\|\s*(\d+)\|\s*\d+\|\s*\d+\|\s*\d+\|\s*(\d+(?:\.\d+)?)\|', re.MULTILINE)
+_RE_CPU_USAGE = re.compile(r'CPU Usage\s*:\s*(\d+)')
+_RE_TOTAL_MEM = re.compile(r'Total Real Memory \(Bytes\)\s*:\s*(\d+)')
+_RE_FREE_MEM = re.compile(r'Free Real Memory \(Bytes\)\s*:\s*(\d+)')
+_RE_STATE = re.compile(r'State:\s*(.+)')
+# Device block of 'cphaprob list': name line, then the first State line before a blank line
+_RE_DEVICE = re.compile(r'Device Name:[ \t]*([^\n]+)\n(?:[^\n]+\n)*?[^\n]*?State:\s*([^\n]+)')
+
+_GIB = 1 << 30
+
 # Mock data for testing
 MOCK_DATA = {
     'cpu': 'CPU Usage: 15%',
@@ -51,6 +70,7 @@ Active PNOTEs: None''',
     'cphaprob_list': 'Device Name: Synchronization\nState: OK\n\nDevice Name: Filter\nState: OK',
     'heavy_conn': '''[fw_60]; conn: 192.168.1.1:3788 -> 192.168.1.3:8080 IPP 6; Instance load: 68%; Connection instance load 91%; StartTime: 17/12/25 03:18:18; Duration: 3; IdentificationTime: 17/12/25 03:18:19; Seervice: 6:8080; Total Bytes: 1123534;'''
 }
+MOCK_DATA['all'] = '\n\n'.join(MOCK_DATA[key] for key in ('cpu', 'memory', 'multi_cpu'))
 
 COLORS = {
     'red': '\033[91m',
@@ -61,11 +81,14 @@ COLORS = {
     'reset': '\033[0m'
 }
 
+# Checked once; stdout is not redirected mid-run
+_IS_TTY = sys.stdout.isatty()
+
 def print_color(text: str, color: str, quiet: bool = False):
     """Print colorized output to terminal."""
     if quiet and color != 'red':
         return
-    if sys.stdout.isatty():
+    if _IS_TTY:
         print(f"{COLORS.get(color, '')}{text}{COLORS['reset']}")
     else:
         print(text)
@@ -87,40 +110,60 @@ def run_command(command: List[str], mock: bool = False, mock_key: str = None) ->
     if mock:
         return MOCK_DATA.get(mock_key, "")
     try:
-        result = subprocess.run(command, capture_output=True, text=True, timeout=10)
-        return result.stdout.strip()
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     except Exception:
         return ""
+    try:
+        out, _ = proc.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return ""
+    return out.decode('utf-8', errors='replace').strip()
 
-def get_cpu_usage(mock: bool = False, warning_threshold: int = 80) -> Tuple[float, float, List[str]]:
+def run_command_tail(command: List[str], count: int, mock: bool = False, mock_key: str = None) -> List[str]:
+    """Return the last non-blank output lines of a command without buffering the rest."""
+    if mock:
+        return [line for line in MOCK_DATA.get(mock_key, "").splitlines() if line.strip()][-count:]
+    try:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception:
+        return []
+    timer = threading.Timer(10, proc.kill)
+    timer.start()
+    try:
+        tail = deque(maxlen=count)
+        for line in proc.stdout:
+            if line.strip():
+                tail.append(line)
+        proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    return [line.decode('utf-8', errors='replace') for line in tail]
+
+def summarize_cpu_rows(rows: List[Tuple[str, str]], warning_threshold: int) -> Tuple[float, float, List[str]]:
+    """Return average usage, max usage and heavy CPU labels for parsed multi_cpu rows."""
+    usages = [float(u) for _, u in rows]
+    heavy_cpus = [f"CPU{c}: {u}%" for (c, _), u in zip(rows, usages) if u >= warning_threshold]
+    return round(sum(usages) / len(usages), 2), max(usages), heavy_cpus
+
+def collect_cpstat_os(mock: bool = False) -> str:
+    """Run 'cpstat os -f all' once so the CPU and memory parsers can share its output."""
+    return run_command(['cpstat', 'os', '-f', 'all'], mock, 'all')
+
+def get_cpu_usage(mock: bool = False, warning_threshold: int = 80, cpstat_all: str = "") -> Tuple[float, float, List[str]]:
     heavy_cpus = []
-    avg_usage = 0.0
-    max_usage = 0.0
     try:
-        output = run_command(['cpstat', 'os', '-f', 'multi_cpu'], mock, 'multi_cpu')
-        cpus = []
-        lines = output.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line.startswith('|') or 'CPU#' in line:
-                continue
-            parts = line.split('|')
-            if len(parts) >= 6:
-                try:
-                    cpu_id = parts[1].strip()
-                    usage = float(parts[5].strip())
-                    cpus.append(usage)
-                    if usage >= warning_threshold:
-                        heavy_cpus.append(f"CPU{cpu_id}: {usage}%")
-                except (ValueError, IndexError):
-                    continue
-        if cpus:
-            avg_usage = round(sum(cpus) / len(cpus), 2)
-            max_usage = max(cpus)
-            return avg_usage, max_usage, heavy_cpus
+        # Only query the individual flavours when 'cpstat os -f all' lacked the section
+        rows = _RE_CPU_ROW.findall(cpstat_all)
+        if not rows:
+            rows = _RE_CPU_ROW.findall(run_command(['cpstat', 'os', '-f', 'multi_cpu'], mock, 'multi_cpu'))
+        if rows:
+            return summarize_cpu_rows(rows, warning_threshold)
         
-        output = run_command(['cpstat', 'os', '-f', 'cpu'], mock, 'cpu')
-        match = re.search(r'CPU Usage\s*:\s*(\d+)', output)
+        match = (_RE_CPU_USAGE.search(cpstat_all) or
+                 _RE_CPU_USAGE.search(run_command(['cpstat', 'os', '-f', 'cpu'], mock, 'cpu')))
         if match:
             usage = float(match.group(1))
             if usage >= warning_threshold:
@@ -130,11 +173,14 @@ def get_cpu_usage(mock: bool = False, warning_threshold: int = 80) -> Tuple[floa
         pass
     return 0.0, 0.0, []
 
-def get_memory_usage(mock: bool = False) -> Tuple[float, int, int]:
+def get_memory_usage(mock: bool = False, cpstat_all: str = "") -> Tuple[float, int, int]:
     try:
-        output = run_command(['cpstat', 'os', '-f', 'memory'], mock, 'memory')
-        total_match = re.search(r'Total Real Memory \(Bytes\)\s*:\s*(\d+)', output)
-        free_match = re.search(r'Free Real Memory \(Bytes\)\s*:\s*(\d+)', output)
+        total_match = _RE_TOTAL_MEM.search(cpstat_all)
+        free_match = _RE_FREE_MEM.search(cpstat_all)
+        if not (total_match and free_match):
+            output = run_command(['cpstat', 'os', '-f', 'memory'], mock, 'memory')
+            total_match = _RE_TOTAL_MEM.search(output)
+            free_match = _RE_FREE_MEM.search(output)
         if total_match and free_match:
             total_bytes = int(total_match.group(1))
             free_bytes = int(free_match.group(1))
@@ -145,17 +191,21 @@ def get_memory_usage(mock: bool = False) -> Tuple[float, int, int]:
         pass
     return 0.0, 0, 0
 
+def format_memory(free_bytes: int, total_bytes: int) -> str:
+    """Return the free-memory display string, in GB and as a percentage."""
+    free_percent = (free_bytes / total_bytes) * 100 if total_bytes > 0 else 0.0
+    return f"Free: {free_bytes / _GIB:.3f}GB ({free_percent:.3f}%)"
+
 def get_cluster_state(mock: bool = False) -> str:
     try:
         output = run_command(['cphaprob', 'state'], mock, 'cluster')
-        match = re.search(r'State:\s*(.+)', output)
+        match = _RE_STATE.search(output)
         if match:
             return match.group(1).strip()
-        for line in output.split('\n'):
+        for line in output.splitlines():
             if '(local)' in line:
-                parts = line.split()
-                if parts:
-                    return parts[-1].capitalize()
+                # Only the last column (State) is needed
+                return line.rsplit(None, 1)[-1].capitalize()
         if "Active" in output:
             return "Active"
         elif "Standby" in output:
@@ -168,15 +218,8 @@ def get_errors(mock: bool = False) -> List[str]:
     errors = []
     try:
         output = run_command(['cphaprob', 'list'], mock, 'cphaprob_list')
-        devices = output.split('\n\n')
-        for device in devices:
-            name_match = re.search(r'Device Name:\s*(.+)', device)
-            state_match = re.search(r'State:\s*(.+)', device)
-            if name_match and state_match:
-                name = name_match.group(1).strip()
-                state = state_match.group(1).strip()
-                if state != 'OK':
-                    errors.append(f"{name}: {state}")
+        errors = [f"{name.strip()}: {state.strip()}"
+                  for name, state in _RE_DEVICE.findall(output) if state.strip() != 'OK']
     except Exception:
         pass
     return errors
@@ -184,15 +227,10 @@ def get_errors(mock: bool = False) -> List[str]:
 def get_heavy_connections(mock: bool = False) -> List[str]:
     heavy_conns = []
     try:
-        from datetime import datetime
         today_str = datetime.now().strftime("%d/%m/%y")
         if mock:
              today_str = "17/12/25"
-        output = run_command(['fw', 'ctl', 'multik', 'print_heavy_conn'], mock, 'heavy_conn')
-        if not output:
-            return []
-        lines = output.strip().split('\n')
-        last_5_lines = lines[-5:]
+        last_5_lines = run_command_tail(['fw', 'ctl', 'multik', 'print_heavy_conn'], 5, mock, 'heavy_conn')
         for line in last_5_lines:
             if today_str in line:
                 heavy_conns.append(line.strip())
@@ -205,26 +243,17 @@ def calculate_severity(
     cluster_state: str, errors: List[str], heavy_connections: List[str],
     warning_threshold: int, error_threshold: int
 ) -> str:
-    severity = 'ok'
-    if cpu_usage >= error_threshold or max_cpu_usage >= error_threshold:
-        severity = 'error'
-    elif (cpu_usage >= warning_threshold or max_cpu_usage >= warning_threshold) and severity != 'error':
-        severity = 'warning'
-        
-    if memory_usage >= error_threshold:
-        severity = 'error'
-    elif memory_usage >= warning_threshold and severity != 'error':
-        severity = 'warning'
-        
-    if cluster_state.lower() in ['down', 'problem', 'error', 'unknown']:
-        severity = 'error'
-    if errors:
-        severity = 'error'
-    if heavy_connections:
-        severity = 'error'
-        
-    return severity
+    # Cheapest checks first so the common error cases return immediately
+    if errors or heavy_connections or cluster_state.lower() in ('down', 'problem', 'error', 'unknown'):
+        return 'error'
+    peak = max(cpu_usage, max_cpu_usage, memory_usage)
+    if peak >= error_threshold:
+        return 'error'
+    if peak >= warning_threshold:
+        return 'warning'
+    return 'ok'
 
+@functools.lru_cache(maxsize=1)
 def get_hostname() -> str:
     try:
         return socket.gethostname()
@@ -235,33 +264,93 @@ def generate_md5_id(system_name: str, project_name: str, hostname: str) -> str:
     unique_string = f"{system_name}-{project_name}-{hostname}".encode('utf-8')
     return hashlib.md5(unique_string).hexdigest()
 
+# Open API connections keyed by (scheme, host), reused across posts, with the
+# proxy headers they need and whether requests carry the full URL (plain HTTP proxy)
+_CONNECTIONS: Dict[Tuple[str, str], Tuple[http.client.HTTPConnection, Dict[str, str], bool]] = {}
+
+def find_proxy(parts: urllib.parse.SplitResult):
+    """Return the proxy http_proxy/https_proxy/no_proxy select for this URL, as urllib would, or None."""
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.hostname or ''):
+        return None
+    return urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+def proxy_auth_headers(proxy: urllib.parse.SplitResult) -> Dict[str, str]:
+    if proxy.username is None:
+        return {}
+    credentials = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+def get_connection(api_url: str) -> Tuple[http.client.HTTPConnection, str, Dict[str, str]]:
+    """Return a keep-alive connection for the API host, the request path and any proxy headers."""
+    parts = urllib.parse.urlsplit(api_url)
+    key = (parts.scheme, parts.netloc)
+    if key not in _CONNECTIONS:
+        proxy = find_proxy(parts)
+        host = proxy.netloc.rpartition('@')[2] if proxy else parts.netloc
+        headers = proxy_auth_headers(proxy) if proxy else {}
+        if parts.scheme == 'https':
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            conn = http.client.HTTPSConnection(host, timeout=10, context=ctx)
+            if proxy:
+                # TLS runs end to end through a CONNECT tunnel; the proxy only sees the tunnel request
+                conn.set_tunnel(parts.netloc, headers=headers)
+                headers = {}
+        else:
+            conn = http.client.HTTPConnection(host, timeout=10)
+        _CONNECTIONS[key] = (conn, headers, proxy is not None and parts.scheme != 'https')
+    conn, headers, absolute = _CONNECTIONS[key]
+    # A plain HTTP proxy takes the full URL as the request target
+    path = urllib.parse.urlunsplit(parts[:4] + ('',)) if absolute else parts.path or '/'
+    if parts.query and not absolute:
+        path += '?' + parts.query
+    return conn, path, headers
+
+def send_json(conn: http.client.HTTPConnection, path: str, json_data: bytes, proxy_headers: Dict[str, str]) -> http.client.HTTPResponse:
+    conn.request('POST', path, body=json_data,
+                 headers={'Content-Type': 'application/json', 'Accept': 'application/json', **proxy_headers})
+    response = conn.getresponse()
+    response.read()
+    return response
+
+@functools.lru_cache(maxsize=8)
+def encoded_body_prefix(project_name: str, system_name: str) -> bytes:
+    """Return the JSON envelope up to the payload value, encoded once per project/system."""
+    return f'{{"projectName":{json.dumps(project_name)},"systemName":{json.dumps(system_name)},"payload":'.encode('utf-8')
+
+def encode_payload(payload: dict) -> bytes:
+    """Encode an API body, serializing only the per-cycle component fields."""
+    prefix = encoded_body_prefix(payload['projectName'], payload['systemName'])
+    return prefix + json.dumps(payload['payload'], separators=(',', ':')).encode('utf-8') + b'}'
+
 def post_to_api(payload: dict, config: dict, args: argparse.Namespace):
     if args.dry_run:
-        print_color(f"[DRY-RUN] Would post: {payload['payload']['Name']} ({payload['payload']['Severity']})", 'magenta', args.quiet)
+        if not args.quiet:
+            print_color(f"[DRY-RUN] Would post: {payload['payload']['Name']} ({payload['payload']['Severity']})", 'magenta')
         return
 
-    json_data = json.dumps(payload).encode('utf-8')
-    request = urllib.request.Request(
-        config['apiUrl'],
-        data=json_data,
-        headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-        method='POST'
-    )
-    
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+    json_data = encode_payload(payload)
+    conn, path, proxy_headers = get_connection(config['apiUrl'])
 
     try:
-        with urllib.request.urlopen(request, timeout=10, context=ctx) as response:
-            if response.status in [200, 201]:
-                print_color(f"[SUCCESS] Posted {payload['payload']['Name']} - {payload['payload']['Severity']}", 'green', args.quiet)
-            else:
-                print_color(f"[WARNING] API returned status {response.status} for {payload['payload']['Name']}", 'yellow', args.quiet)
+        try:
+            response = send_json(conn, path, json_data, proxy_headers)
+        except ConnectionError:
+            # Server dropped the kept-alive socket; reconnect once
+            conn.close()
+            response = send_json(conn, path, json_data, proxy_headers)
+        if not 200 <= response.status < 300:
+            print_color(f"[ERROR] API returned status {response.status} for {payload['payload']['Name']}", 'red')
+        # Only format the success message when it will actually be printed
+        elif not args.quiet:
+            print_color(f"[SUCCESS] Posted {payload['payload']['Name']} - {payload['payload']['Severity']}", 'green')
     except Exception as e:
+        conn.close()
         print_color(f"[ERROR] Failed to post {payload['payload']['Name']}: {str(e)}", 'red')
 
-def main():
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Checkpoint Firewall Agent')
     parser.add_argument('--config-path', type=str, default='config.json', help='Path to config.json')
     parser.add_argument('--api-url', type=str, help='Override API URL')
@@ -271,9 +360,10 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Do not post to API')
     parser.add_argument('--mock', action='store_true', help='Use mock data')
     parser.add_argument('--quiet', action='store_true', help='Suppress non-error output')
-    
-    args = parser.parse_args()
+    return parser.parse_args(argv)
 
+def run(args: argparse.Namespace):
+    """Collect and post metrics once; callable from a long-running wrapper without re-parsing."""
     # Load configuration
     config = {
         "apiUrl": "https://overview/api/components",
@@ -306,11 +396,20 @@ def main():
     err_thresh = config.get('thresholds', {}).get('error', 90)
 
     try:
-        cpu_usage, max_cpu_usage, heavy_cpus = get_cpu_usage(args.mock, warn_thresh)
-        memory_usage, total_mem, free_mem = get_memory_usage(args.mock)
-        cluster_state = get_cluster_state(args.mock)
-        errors = get_errors(args.mock)
-        heavy_connections = get_heavy_connections(args.mock)
+        # Collectors only wait on their own subprocess, so run them side by side
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            f_cpstat = executor.submit(collect_cpstat_os, args.mock)
+            f_cluster = executor.submit(get_cluster_state, args.mock)
+            f_errors = executor.submit(get_errors, args.mock)
+            f_heavy = executor.submit(get_heavy_connections, args.mock)
+            cpstat_all = f_cpstat.result()
+            f_cpu = executor.submit(get_cpu_usage, args.mock, warn_thresh, cpstat_all)
+            f_mem = executor.submit(get_memory_usage, args.mock, cpstat_all)
+            cpu_usage, max_cpu_usage, heavy_cpus = f_cpu.result()
+            memory_usage, total_mem, free_mem = f_mem.result()
+            cluster_state = f_cluster.result()
+            errors = f_errors.result()
+            heavy_connections = f_heavy.result()
         
         severity = calculate_severity(
             cpu_usage, max_cpu_usage, memory_usage,
@@ -323,9 +422,7 @@ def main():
         
         error_str = "No Errors" if not errors else ", ".join(errors)
         cpu_str = f"{cpu_usage}%" + (f" (Heavy: {', '.join(heavy_cpus)})" if heavy_cpus else "")
-        free_gb = round(free_mem / (1024**3), 3)
-        free_percent = round((free_mem / total_mem) * 100, 3) if total_mem > 0 else 0.0
-        mem_str = f"Free: {free_gb:.3f}GB ({free_percent:.3f}%)"
+        mem_str = format_memory(free_mem, total_mem)
         heavy_conn_str = f"{len(heavy_connections)} found" if heavy_connections else "None"
             
         payload = {
@@ -350,5 +447,8 @@ def main():
         print_color(f"Error: {e}", 'red')
         sys.exit(1)
 
+def main():
+    run(parse_args())
+
 if __name__ == '__main__':
     main()
@@ -7,17 +7,25 @@ Computes severity (ok/warning/error) based on configurable thresholds.
 """
 
 import argparse
+import base64
+import fcntl
 import hashlib
+import http.client
 import json
 import os
 import random
 import socket
+import ssl
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import urllib.parse
 import urllib.request
-import urllib.error
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Tuple
 
 # Default ignore patterns for services
 DEFAULT_IGNORE_SERVICES = [
@@ -31,29 +39,133 @@ DEFAULT_IGNORE_SERVICES = [
     'logrotate.timer',
 ]
 
+# Virtual / pseudo filesystems left out of disk usage
+DISK_EXCLUDE_TYPES = frozenset(('tmpfs', 'devtmpfs', 'squashfs', 'overlay', 'proc', 'sysfs', 'devpts', 'cgroup'))
+
+# Seconds to wait for the mount scan, the same bound the df call had
+DISK_SCAN_TIMEOUT = 10
+
+def has_mem_available() -> bool:
+    try:
+        with open('/proc/meminfo', 'rb') as f:
+            return any(line.startswith(b'MemAvailable:') for line in f)
+    except OSError:
+        return False
+
+# MemAvailable exists since Linux 3.14 and is backported to some older kernels (e.g. RHEL 7);
+# without it, estimate from MemFree + Buffers + Cached. Probed once, so the per-call path reads only what it needs.
+_LEGACY_KERNEL = not has_mem_available()
+MEMINFO_KEYS = frozenset((b'MemTotal', b'MemFree', b'Buffers', b'Cached') if _LEGACY_KERNEL else (b'MemTotal', b'MemAvailable'))
+
+# Units per 'systemctl is-active' call, keeps argv well below ARG_MAX
+IS_ACTIVE_BATCH_SIZE = 256
+
+# Last /proc/stat sample, kept between runs so the CPU delta needs no sleep.
+# Sized to cover the default 5-minute cron interval. The temp dir is shared, so the
+# name is per user and the file is only trusted if that user owns it (see open_cpu_state).
+CPU_STATE_FILE = os.path.join(tempfile.gettempdir(), f'linux_agent_cpustat.{os.getuid()}.json')
+CPU_STATE_MAX_AGE = 600
+
+# Sampling window when there is no usable cached sample. /proc/stat counts CLK_TCK
+# ticks (usually 100/s) per CPU, so the window spans about CPU_SAMPLE_TICKS ticks across
+# all CPUs: one stray tick then moves the reading by ~1%. 1s on one CPU, shorter on more.
+CPU_SAMPLE_TICKS = 100
+
+def default_cpu_sample_ms() -> int:
+    ticks_per_sec = os.sysconf('SC_CLK_TCK') * (os.cpu_count() or 1)
+    return min(1000, max(100, -(-1000 * CPU_SAMPLE_TICKS // ticks_per_sec)))
+
+DEFAULT_CPU_SAMPLE_MS = default_cpu_sample_ms()
+
+# Open API connections keyed by (scheme, host), reused across posts, with the
+# proxy headers they need and whether requests carry the full URL (plain HTTP proxy)
+_CONNECTIONS: Dict[Tuple[str, str], Tuple[http.client.HTTPConnection, Dict[str, str], bool]] = {}
+
+# Resolved once per process; the hostname does not change between collections
+try:
+    _HOSTNAME = socket.gethostname()
+except OSError:
+    _HOSTNAME = os.uname().nodename
+
+COLORS = {
+    'red': '\033[91m',
+    'green': '\033[92m',
+    'yellow': '\033[93m',
+    'cyan': '\033[96m',
+    'reset': '\033[0m'
+}
+
+# Checked once; stdout is not redirected mid-run
+_IS_TTY = sys.stdout.isatty()
+
+def get_hostname() -> str:
+    return _HOSTNAME
+
 def print_colored(text: str, color: str):
-    colors = {
-        'red': '\033[91m',
-        'green': '\033[92m',
-        'yellow': '\033[93m',
-        'cyan': '\033[96m',
-        'reset': '\033[0m'
-    }
-    if sys.stdout.isatty():
-        print(f"{colors.get(color, '')}{text}{colors['reset']}")
+    if _IS_TTY:
+        print(f"{COLORS.get(color, '')}{text}{COLORS['reset']}")
     else:
         print(text)
 
-def get_cpu_usage(mock: bool) -> float:
+def read_boot_id() -> str:
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f: return f.read().strip()
+    except OSError:
+        return ''
+
+_BOOT_ID = read_boot_id()
+
+def read_cpu_times() -> Tuple[int, int]:
+    # One raw read covers the aggregate 'cpu' line: user nice system idle iowait irq softirq ...
+    fd = os.open('/proc/stat', os.O_RDONLY)
+    try: buf = os.read(fd, 512)
+    finally: os.close(fd)
+    fields = buf.split(None, 8)
+    return int(fields[4]), sum(map(int, fields[1:8]))
+
+def measure_cpu_times(window: float) -> Tuple[int, int, int, int]:
+    idle1, total1 = read_cpu_times()
+    time.sleep(window)
+    return (idle1, total1) + read_cpu_times()
+
+def open_cpu_state():
+    # O_NOFOLLOW refuses a planted symlink; a file someone else created is refused too
+    fd = os.open(CPU_STATE_FILE, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    st = os.fstat(fd)
+    if st.st_uid != os.getuid() or not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        raise PermissionError(f"untrusted CPU state file: {CPU_STATE_FILE}")
+    return os.fdopen(fd, 'r+')
+
+def sample_cpu_times(window: float) -> Tuple[int, int, int, int]:
+    """Return (idle1, total1, idle2, total2), reusing the previous run's sample while it is fresh."""
+    try:
+        state = open_cpu_state()
+    except OSError:
+        return measure_cpu_times(window)
+    with state:
+        fcntl.flock(state, fcntl.LOCK_EX)
+        state.seek(0)
+        try:
+            prev = json.load(state)
+            prev_times = (int(prev['idle']), int(prev['total']))
+            # Counters and monotonic time both restart at boot, so only reuse a sample
+            # from this boot. Never measure over a shorter window than the sleep would.
+            fresh = prev['boot_id'] == _BOOT_ID and window <= time.monotonic() - prev['timestamp'] < CPU_STATE_MAX_AGE
+        except (ValueError, KeyError, TypeError):
+            fresh = False
+        sample = prev_times + read_cpu_times() if fresh else None
+        if sample is None or not 0 <= sample[2] - sample[0] <= sample[3] - sample[1] or sample[3] <= sample[1]:
+            sample = measure_cpu_times(window)
+        state.seek(0)
+        state.truncate()
+        json.dump({'idle': sample[2], 'total': sample[3], 'timestamp': time.monotonic(), 'boot_id': _BOOT_ID}, state)
+    return sample
+
+def get_cpu_usage(mock: bool, sample_ms: int = DEFAULT_CPU_SAMPLE_MS) -> float:
     if mock: return round(random.uniform(10, 99), 2)
     try:
-        with open('/proc/stat', 'r') as f: line1 = f.readline()
-        fields1 = line1.split()
-        idle1, total1 = int(fields1[4]), sum(int(x) for x in fields1[1:])
-        time.sleep(1)
-        with open('/proc/stat', 'r') as f: line2 = f.readline()
-        fields2 = line2.split()
-        idle2, total2 = int(fields2[4]), sum(int(x) for x in fields2[1:])
+        idle1, total1, idle2, total2 = sample_cpu_times(sample_ms / 1000)
         idle_d, total_d = idle2 - idle1, total2 - total1
         return 0.0 if total_d == 0 else round((1 - (idle_d / total_d)) * 100, 2)
     except Exception:
@@ -62,62 +174,176 @@ def get_cpu_usage(mock: bool) -> float:
 def get_memory_usage(mock: bool) -> float:
     if mock: return round(random.uniform(10, 99), 2)
     try:
+        # Only parse the few fields we use, and stop once they are all in
         mem = {}
-        with open('/proc/meminfo', 'r') as f:
+        with open('/proc/meminfo', 'rb') as f:
             for line in f:
-                parts = line.split()
-                if len(parts) >= 2: mem[parts[0].rstrip(':')] = int(parts[1])
-        total, available = mem.get('MemTotal', 0), mem.get('MemAvailable', 0)
+                key, _, rest = line.partition(b':')
+                if key in MEMINFO_KEYS:
+                    mem[key] = int(rest.split(None, 1)[0])
+                    if len(mem) == len(MEMINFO_KEYS): break
+        total = mem.get(b'MemTotal', 0)
         if total == 0: return 0.0
-        if available == 0: available = mem.get('MemFree', 0) + mem.get('Buffers', 0) + mem.get('Cached', 0)
+        if _LEGACY_KERNEL: available = mem.get(b'MemFree', 0) + mem.get(b'Buffers', 0) + mem.get(b'Cached', 0)
+        else: available = mem.get(b'MemAvailable', 0)
         return round(((total - available) / total) * 100, 2)
     except Exception:
         return 0.0
 
-def get_disk_usage(mock: bool) -> List[Dict[str, Any]]:
-    if mock: return [{'device': '/dev/sda1', 'mount_point': '/', 'used_percent': round(random.uniform(10, 99), 2)}]
-    disks = []
-    excludes = {'tmpfs', 'devtmpfs', 'squashfs', 'overlay', 'proc', 'sysfs', 'devpts', 'cgroup'}
+def unescape_mount_field(field: str) -> str:
+    # /proc/mounts octal-escapes space, tab, newline and backslash
+    return field.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+def scan_mounts(disks: Dict[int, Dict[str, Any]]):
+    """Fill disks with the usage of each mounted block filesystem, keyed by st_dev."""
+    # Keyed by st_dev: bind mounts and repeat mounts of one filesystem are reported
+    # once, under the shortest mount point, as df does
     try:
-        res = subprocess.run(['df', '-PT'], capture_output=True, text=True, timeout=10)
-        for line in res.stdout.strip().split('\n')[1:]:
-            parts = line.split()
-            if len(parts) >= 7 and parts[1] not in excludes and parts[0].startswith('/'):
-                try: disks.append({'device': parts[0], 'mount_point': parts[6], 'used_percent': float(parts[5].rstrip('%'))})
-                except ValueError: pass
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                # device, mount point, fstype; the options and dump/pass fields stay unsplit
+                parts = line.split(None, 3)
+                if len(parts) < 3 or parts[2] in DISK_EXCLUDE_TYPES or not parts[0].startswith('/'): continue
+                mount_point = unescape_mount_field(parts[1])
+                try:
+                    dev = os.stat(mount_point).st_dev
+                    if dev in disks and len(disks[dev]['mount_point']) <= len(mount_point): continue
+                    st = os.statvfs(mount_point)
+                except OSError: continue
+                # Same basis as df: used / (used + available to non-root)
+                used = st.f_blocks - st.f_bfree
+                usable = used + st.f_bavail
+                if usable > 0:
+                    disks[dev] = {'device': unescape_mount_field(parts[0]), 'mount_point': mount_point, 'used_percent': round(used * 100 / usable, 2)}
     except Exception:
         pass
-    return disks
+
+def get_disk_usage(mock: bool, timeout: float = DISK_SCAN_TIMEOUT) -> List[Dict[str, Any]]:
+    if mock: return [{'device': '/dev/sda1', 'mount_point': '/', 'used_percent': round(random.uniform(10, 99), 2)}]
+    # stat() on a hung network mount blocks with no timeout of its own. The scan runs on a
+    # daemon thread, so it is bounded like the old df call and cannot keep the process alive;
+    # mounts scanned before the deadline are still reported.
+    disks = {}
+    scan = threading.Thread(target=scan_mounts, args=(disks,), daemon=True)
+    scan.start()
+    scan.join(timeout)
+    return list(disks.values())
+
+def compile_ignore_list(ignore_list: List[str]) -> Tuple[frozenset, Tuple[str, ...]]:
+    """Split ignore patterns into exact names and 'prefix*' prefixes for one-call matching."""
+    exact = frozenset(p for p in ignore_list if not p.endswith('*'))
+    prefixes = tuple(p[:-1] for p in ignore_list if p.endswith('*'))
+    return exact, prefixes
 
 def get_failed_services(mock: bool, ignore_list: List[str]) -> List[str]:
     if mock: return ["mock-service.service"] if random.random() > 0.7 else []
     failed = []
+    exact, prefixes = compile_ignore_list(ignore_list)
     try:
-        res = subprocess.run(['systemctl', 'list-units', '--state=failed', '--no-legend', '--plain'], capture_output=True, text=True, timeout=10)
-        for line in res.stdout.strip().split('\n'):
-            if line:
-                svc = line.split()[0]
-                if not any(svc.startswith(p[:-1]) if p.endswith('*') else svc == p for p in ignore_list):
+        res = subprocess.run(['systemctl', 'list-units', '--state=failed', '--no-legend', '--plain', '--no-pager'], capture_output=True, timeout=10)
+        for line in res.stdout.splitlines():
+            parts = line.split(None, 1)
+            if parts:
+                svc = parts[0].decode('ascii', 'replace')
+                if not (svc in exact or svc.startswith(prefixes)):
                     failed.append(svc)
     except Exception:
         pass
     return failed
 
+def get_unit_states(units: List[str]) -> List[str]:
+    """Return the is-active state of each unit, asking systemctl about many units per call."""
+    states = []
+    for i in range(0, len(units), IS_ACTIVE_BATCH_SIZE):
+        batch = units[i:i + IS_ACTIVE_BATCH_SIZE]
+        res = subprocess.run(['systemctl', 'is-active', '--'] + batch, capture_output=True, timeout=15)
+        # One word per unit, so a single decode and split yields the states
+        lines = res.stdout.decode('ascii', 'replace').split()
+        if len(lines) != len(batch):
+            # Output no longer lines up with the batch (e.g. a unit failed to resolve); ask per unit
+            lines = [subprocess.run(['systemctl', 'is-active', '--', u], capture_output=True, timeout=5).stdout.decode('ascii', 'replace').strip() for u in batch]
+        states.extend(lines)
+    return states
+
 def get_stopped_automatic_services(mock: bool, ignore_list: List[str]) -> List[str]:
     if mock: return []
     stopped = []
+    exact, prefixes = compile_ignore_list(ignore_list)
     try:
-        res = subprocess.run(['systemctl', 'list-unit-files', '--type=service', '--state=enabled', '--no-legend', '--plain'], capture_output=True, text=True, timeout=10)
-        for line in res.stdout.strip().split('\n'):
-            if line:
-                svc = line.split()[0]
-                if not any(svc.startswith(p[:-1]) if p.endswith('*') else svc == p for p in ignore_list):
-                    act = subprocess.run(['systemctl', 'is-active', svc], capture_output=True, text=True, timeout=5)
-                    if act.stdout.strip() not in ('active', 'activating'): stopped.append(svc)
+        res = subprocess.run(['systemctl', 'list-unit-files', '--type=service', '--state=enabled', '--no-legend', '--plain', '--no-pager'], capture_output=True, timeout=10)
+        names = []
+        for line in res.stdout.splitlines():
+            parts = line.split(None, 1)
+            if parts:
+                svc = parts[0].decode('ascii', 'replace')
+                if not (svc in exact or svc.startswith(prefixes)):
+                    names.append(svc)
+        for svc, state in zip(names, get_unit_states(names)):
+            if state not in ('active', 'activating'): stopped.append(svc)
     except Exception:
         pass
     return stopped
 
+def calculate_severity(cpu: float, mem: float, disks: List[Dict[str, Any]], problem_services: List[str],
+                       warn_thresh: float, err_thresh: float) -> str:
+    # The worst of CPU, memory and every disk decides the threshold level
+    worst = max(cpu, mem, max((d['used_percent'] for d in disks), default=0))
+    if problem_services or worst >= err_thresh: return 'error'
+    if worst >= warn_thresh: return 'warning'
+    return 'ok'
+
+def find_proxy(parts: urllib.parse.SplitResult):
+    """Return the proxy http_proxy/https_proxy/no_proxy select for this URL, as urllib would, or None."""
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.hostname or ''): return None
+    return urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+def proxy_auth_headers(proxy: urllib.parse.SplitResult) -> Dict[str, str]:
+    if proxy.username is None: return {}
+    credentials = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+def get_connection(api_url: str, timeout: int) -> Tuple[http.client.HTTPConnection, str, Dict[str, str]]:
+    """Return a pooled keep-alive connection for the API host, the request path and any proxy headers."""
+    parts = urllib.parse.urlsplit(api_url)
+    key = (parts.scheme, parts.netloc)
+    if key not in _CONNECTIONS:
+        proxy = find_proxy(parts)
+        host = proxy.netloc.rpartition('@')[2] if proxy else parts.netloc
+        headers = proxy_auth_headers(proxy) if proxy else {}
+        if parts.scheme == 'https':
+            conn = http.client.HTTPSConnection(host, timeout=timeout, context=ssl.create_default_context())
+            # TLS runs end to end through a CONNECT tunnel; the proxy only sees the tunnel request
+            if proxy: conn.set_tunnel(parts.netloc, headers=headers); headers = {}
+        else: conn = http.client.HTTPConnection(host, timeout=timeout)
+        _CONNECTIONS[key] = (conn, headers, proxy is not None and parts.scheme != 'https')
+    conn, headers, absolute = _CONNECTIONS[key]
+    # A plain HTTP proxy takes the full URL as the request target
+    if absolute: return conn, urllib.parse.urlunsplit(parts[:4] + ('',)), headers
+    path = parts.path or '/'
+    if parts.query: path += '?' + parts.query
+    return conn, path, headers
+
+def post_metrics(api_url: str, body: Dict[str, Any], timeout: int = 15, retries: int = 2) -> int:
+    """POST the metrics body and return the HTTP status, reconnecting when the connection drops."""
+    data = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    conn, path, proxy_headers = get_connection(api_url, timeout)
+    for attempt in range(retries + 1):
+        try:
+            conn.request('POST', path, body=data, headers={'Content-Type': 'application/json', **proxy_headers})
+            res = conn.getresponse()
+            res.read()
+            return res.status
+        except ConnectionError:
+            conn.close()
+            if attempt == retries: raise
+            time.sleep(0.1 * (2 ** attempt))
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0: raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description='Gather Linux system metrics')
     parser.add_argument('--config-path', type=str, default=os.path.join(os.path.dirname(__file__), 'config.json'))
@@ -128,6 +354,7 @@ def main():
     parser.add_argument('--dry-run', action='store_true')
     parser.add_argument('--mock', action='store_true')
     parser.add_argument('--quiet', action='store_true')
+    parser.add_argument('--cpu-sample-ms', type=positive_int, default=DEFAULT_CPU_SAMPLE_MS)
     args = parser.parse_args()
 
     config = {}
@@ -157,24 +384,21 @@ def main():
         if args.dry_run: print_colored("[MODE] DryRun - No data will be sent to API", 'yellow')
         if args.mock: print_colored("[MODE] MockRun - Using fake data", 'yellow')
 
-    cpu = get_cpu_usage(args.mock)
-    mem = get_memory_usage(args.mock)
-    disks = get_disk_usage(args.mock)
-    failed = get_failed_services(args.mock, ignore_svcs)
-    stopped = get_stopped_automatic_services(args.mock, ignore_svcs)
-    all_prob = list(set(failed + stopped))
-
-    severity = 'ok'
-    if cpu >= err_thresh: severity = 'error'
-    elif cpu >= warn_thresh and severity != 'error': severity = 'warning'
-    if mem >= err_thresh: severity = 'error'
-    elif mem >= warn_thresh and severity != 'error': severity = 'warning'
-    for d in disks:
-        if d['used_percent'] >= err_thresh: severity = 'error'
-        elif d['used_percent'] >= warn_thresh and severity != 'error': severity = 'warning'
-    if all_prob: severity = 'error'
-
-    hostname = socket.gethostname()
+    # Collectors wait on /proc reads, a sleep or systemctl, so run them side by side
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        f_mem = ex.submit(get_memory_usage, args.mock)
+        f_disk = ex.submit(get_disk_usage, args.mock)
+        # Sample CPU before starting systemctl, so the agent's own work stays out of the window
+        cpu = get_cpu_usage(args.mock, args.cpu_sample_ms)
+        f_failed = ex.submit(get_failed_services, args.mock, ignore_svcs)
+        f_stopped = ex.submit(get_stopped_automatic_services, args.mock, ignore_svcs)
+        mem, disks = f_mem.result(), f_disk.result()
+        failed, stopped = f_failed.result(), f_stopped.result()
+    all_prob = list(dict.fromkeys(failed + stopped))
+
+    severity = calculate_severity(cpu, mem, disks, all_prob, warn_thresh, err_thresh)
+
+    hostname = get_hostname()
     metric_name = "System"
     id_source = f"{system_name}|{project_name}|{hostname}|{metric_name}"
     comp_id = hashlib.md5(id_source.encode()).hexdigest().upper()
@@ -196,7 +420,7 @@ def main():
     body = {
         'systemName': system_name,
         'projectName': project_name,
-        'payload': json.dumps(payload_dict)
+        'payload': json.dumps(payload_dict, separators=(',', ':'))
     }
 
     if not args.quiet:
@@ -221,15 +445,16 @@ def main():
     if args.dry_run:
         if not args.quiet:
             print_colored("\n[DRY RUN] Skipping API POST.", 'yellow')
-            print(json.dumps(body, indent=2))
+            # Indent for people; piped consumers get compact JSON
+            print(json.dumps(body, indent=2) if _IS_TTY else json.dumps(body, separators=(',', ':')))
         return
 
     if api_url:
         if not args.quiet: print_colored(f"\nPosting to API: {api_url}", 'cyan')
         try:
-            req = urllib.request.Request(api_url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'})
-            with urllib.request.urlopen(req, timeout=15) as res:
-                if not args.quiet: print_colored("[SUCCESS] Metrics posted successfully.", 'green')
+            status = post_metrics(api_url, body)
+            if not 200 <= status < 300: print_colored(f"[ERROR] Failed to post to API: HTTP {status}", 'red')
+            elif not args.quiet: print_colored("[SUCCESS] Metrics posted successfully.", 'green')
         except Exception as e:
             print_colored(f"[ERROR] Failed to post to API: {e}", 'red')
     else:
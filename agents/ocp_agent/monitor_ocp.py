@@ -7,14 +7,25 @@ Follows the Overview Dashboard Agent Development Guide standards.
 """
 
 import argparse
+import base64
 import json
 import os
 import subprocess
 import sys
+import tempfile
 import hashlib
+import http.client
+import urllib.parse
 import urllib.request
-import urllib.error
 import ssl
+from typing import Callable, Dict, Iterator, List, Tuple
+
+try:
+    import ijson  # optional: streams large 'oc get' output instead of loading it whole
+    _JSON_ERRORS = (ValueError, ijson.JSONError)
+except ImportError:
+    ijson = None
+    _JSON_ERRORS = (ValueError,)
 
 # Define terminal colors
 COLORS = {
@@ -26,11 +37,14 @@ COLORS = {
     'reset': '\033[0m'
 }
 
+# Checked once; stdout is not redirected mid-run
+_IS_TTY = sys.stdout.isatty()
+
 def print_color(text: str, color: str, quiet: bool = False):
     """Print colorized output to terminal."""
     if quiet and color != 'red':
         return
-    if sys.stdout.isatty():
+    if _IS_TTY:
         print(f"{COLORS.get(color, '')}{text}{COLORS['reset']}")
     else:
         print(text)
@@ -72,43 +86,57 @@ def get_mock_data(k8s_kind: str) -> dict:
         }
     return {"items": []}
 
-def run_oc(command: str, mock: bool, k8s_kind: str) -> dict:
-    """Run an oc command and return the JSON output."""
+def iter_oc_items(argv: List[str], mock: bool, k8s_kind: str) -> Iterator[dict]:
+    """Run an oc command (argv form, no shell) and yield the entries of its JSON 'items' list.
+
+    With ijson installed the output is parsed as it streams, so only one resource is
+    held in memory at a time; otherwise the whole document is loaded with json.
+    """
     if mock:
-        return get_mock_data(k8s_kind)
-        
-    try:
-        subprocess.run(["oc", "version", "--client"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except FileNotFoundError:
-        print_color("Error: oc not found. Please ensure oc is installed and in your PATH.", 'red')
-        return None
-    except subprocess.CalledProcessError:
-        pass
+        yield from get_mock_data(k8s_kind).get('items', [])
+        return
 
-    try:
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print_color(f"Error running command '{command}': {e.stderr}", 'red')
-        return None
-    except json.JSONDecodeError:
-        print_color(f"Error decoding JSON from command '{command}'", 'red')
-        return None
+    command = ' '.join(argv)
+    # stderr goes to a temp file, not a pipe: nothing reads it while stdout is
+    # streaming, and a full stderr pipe would block oc and hang both sides
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=stderr_file)
+        except FileNotFoundError:
+            print_color("Error: oc not found. Please ensure oc is installed and in your PATH.", 'red')
+            return
 
-def calculate_status(kind: str, spec: dict, status: dict) -> tuple:
-    """Determine the status string and severity based on resource kind and status."""
-    desired = 0
-    current = 0
-    
-    if kind == "deployments":
-        desired = spec.get('replicas', 1)
-        current = status.get('availableReplicas', 0)
-    elif kind == "statefulsets":
-        desired = spec.get('replicas', 1)
-        current = status.get('readyReplicas', 0)
-    elif kind == "daemonsets":
-        desired = status.get('desiredNumberScheduled', 0)
-        current = status.get('numberReady', 0)
+        decode_failed = False
+        try:
+            if ijson is not None:
+                yield from ijson.items(proc.stdout, 'items.item')
+            else:
+                yield from json.load(proc.stdout).get('items', [])
+        except _JSON_ERRORS:
+            # Empty or truncated output; reported below unless oc itself failed
+            decode_failed = True
+        finally:
+            proc.stdout.close()
+            if proc.wait() != 0:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode('utf-8', errors='replace')
+                print_color(f"Error running command '{command}': {stderr}", 'red')
+            elif decode_failed:
+                print_color(f"Error decoding JSON from command '{command}'", 'red')
+
+# (desired, current) replica counts per resource kind, looked up once per kind
+EXTRACTORS = {
+    "deployments": lambda spec, status: (spec.get('replicas', 1), status.get('availableReplicas', 0)),
+    "statefulsets": lambda spec, status: (spec.get('replicas', 1), status.get('readyReplicas', 0)),
+    "daemonsets": lambda spec, status: (status.get('desiredNumberScheduled', 0), status.get('numberReady', 0)),
+}
+
+def no_replicas(spec: dict, status: dict) -> tuple:
+    return 0, 0
+
+def calculate_status(extractor: Callable[[dict, dict], tuple], spec: dict, status: dict) -> tuple:
+    """Determine the status string and severity from the kind's replica extractor."""
+    desired, current = extractor(spec, status)
 
     status_str = "Unknown"
     severity = "info"
@@ -129,31 +157,79 @@ def calculate_status(kind: str, spec: dict, status: dict) -> tuple:
 
     return status_str, severity, desired, current
 
+# Open API connections keyed by (scheme, host), reused across the per-resource posts, with
+# the proxy headers they need and whether requests carry the full URL (plain HTTP proxy)
+_CONNECTIONS: Dict[Tuple[str, str], Tuple[http.client.HTTPConnection, Dict[str, str], bool]] = {}
+
+def find_proxy(parts: urllib.parse.SplitResult):
+    """Return the proxy http_proxy/https_proxy/no_proxy select for this URL, as urllib would, or None."""
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.hostname or ''):
+        return None
+    return urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+def proxy_auth_headers(proxy: urllib.parse.SplitResult) -> Dict[str, str]:
+    if proxy.username is None:
+        return {}
+    credentials = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+def get_connection(api_url: str) -> Tuple[http.client.HTTPConnection, str, Dict[str, str]]:
+    """Return a keep-alive connection for the API host, the request path and any proxy headers."""
+    parts = urllib.parse.urlsplit(api_url)
+    key = (parts.scheme, parts.netloc)
+    if key not in _CONNECTIONS:
+        proxy = find_proxy(parts)
+        host = proxy.netloc.rpartition('@')[2] if proxy else parts.netloc
+        headers = proxy_auth_headers(proxy) if proxy else {}
+        if parts.scheme == 'https':
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            conn = http.client.HTTPSConnection(host, timeout=10, context=ctx)
+            if proxy:
+                # TLS runs end to end through a CONNECT tunnel; the proxy only sees the tunnel request
+                conn.set_tunnel(parts.netloc, headers=headers)
+                headers = {}
+        else:
+            conn = http.client.HTTPConnection(host, timeout=10)
+        _CONNECTIONS[key] = (conn, headers, proxy is not None and parts.scheme != 'https')
+    conn, headers, absolute = _CONNECTIONS[key]
+    # A plain HTTP proxy takes the full URL as the request target
+    path = urllib.parse.urlunsplit(parts[:4] + ('',)) if absolute else parts.path or '/'
+    if parts.query and not absolute:
+        path += '?' + parts.query
+    return conn, path, headers
+
+def send_json(conn: http.client.HTTPConnection, path: str, json_data: bytes, proxy_headers: Dict[str, str]) -> http.client.HTTPResponse:
+    conn.request('POST', path, body=json_data,
+                 headers={'Content-Type': 'application/json', 'Accept': 'application/json', **proxy_headers})
+    response = conn.getresponse()
+    response.read()
+    return response
+
 def post_to_api(payload: dict, config: dict, args: argparse.Namespace):
     """POST component payload to the API."""
     if args.dry_run:
         print_color(f"[DRY-RUN] Would post: {payload['payload']['Name']} ({payload['payload']['Severity']})", 'magenta', args.quiet)
         return
 
-    json_data = json.dumps(payload).encode('utf-8')
-    request = urllib.request.Request(
-        config['apiUrl'],
-        data=json_data,
-        headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-        method='POST'
-    )
-    
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+    json_data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    conn, path, proxy_headers = get_connection(config['apiUrl'])
 
     try:
-        with urllib.request.urlopen(request, timeout=10, context=ctx) as response:
-            if response.status in [200, 201]:
-                print_color(f"[SUCCESS] Posted {payload['payload']['Name']} - {payload['payload']['Severity']}", 'green', args.quiet)
-            else:
-                print_color(f"[WARNING] API returned status {response.status} for {payload['payload']['Name']}", 'yellow', args.quiet)
+        try:
+            response = send_json(conn, path, json_data, proxy_headers)
+        except ConnectionError:
+            # Server dropped the kept-alive socket; reconnect once
+            conn.close()
+            response = send_json(conn, path, json_data, proxy_headers)
+        if 200 <= response.status < 300:
+            print_color(f"[SUCCESS] Posted {payload['payload']['Name']} - {payload['payload']['Severity']}", 'green', args.quiet)
+        else:
+            print_color(f"[ERROR] API returned status {response.status} for {payload['payload']['Name']}", 'red')
     except Exception as e:
+        conn.close()
         print_color(f"[ERROR] Failed to post {payload['payload']['Name']}: {str(e)}", 'red')
 
 def main():
@@ -203,13 +279,8 @@ def main():
 
     for res_name, k8s_kind in resources_to_check.items():
         print_color(f"\nCollecting {k8s_kind}...", 'cyan', args.quiet)
-        data = run_oc(f"oc get {k8s_kind} --all-namespaces -o json", args.mock, k8s_kind)
-        
-        if not data:
-            continue
-
-        items = data.get('items', [])
-        for item in items:
+        extractor = EXTRACTORS.get(k8s_kind, no_replicas)
+        for item in iter_oc_items(["oc", "get", k8s_kind, "--all-namespaces", "-o", "json"], args.mock, k8s_kind):
             metadata = item.get('metadata', {})
             status_obj = item.get('status', {})
             spec_obj = item.get('spec', {})
@@ -222,7 +293,7 @@ def main():
             if config.get('namespaces') and namespace not in config['namespaces']:
                 continue
             
-            status_str, severity, desired, current = calculate_status(k8s_kind, spec_obj, status_obj)
+            status_str, severity, desired, current = calculate_status(extractor, spec_obj, status_obj)
             component_id = generate_md5_id(config['systemName'], config['projectName'], name, namespace)
             
             resource_entry = {